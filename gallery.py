@@ -7,12 +7,16 @@ from google.cloud import storage, bigquery
 import random
 import argparse
 import numpy as np
+import search
+import sprites
+import json
 
 load_dotenv()
 PROJECT_ID = os.environ["PROJECT_ID"]
 GCP_BUCKET_NAME = os.environ["GCP_BUCKET_NAME"]
 BIGQUERY_DATASET_ID = os.environ["BIGQUERY_DATASET_ID"]
 BIGQUERY_TABLE_ID2 = os.environ["BIGQUERY_TABLE_ID2"]
+SEARCH_RESULTS = 200
 
 def load_custom_css():
 
@@ -29,7 +33,7 @@ def fetch_gallery_metadata():
 
     table_ref = f"{BIGQUERY_DATASET_ID}.{BIGQUERY_TABLE_ID2}"
     query = f"""
-            SELECT prompt_concept, images, thumbnails_public_url
+            SELECT id, prompt_concept, images, thumbnails_public_url
             FROM `{table_ref}`
             """
 
@@ -44,6 +48,75 @@ def fetch_gallery_metadata():
 
         return pd.DataFrame()
 
+@st.cache_resource
+def load_search_index(version):
+    """Cached per index version, so prompts added by a later upload run become searchable."""
+
+    return search.load_search_index(os.path.join(search.SEARCH_INDEX_PATH, search.SEARCH_INDEX_FILE))
+
+def get_search_index():
+
+    index_file = os.path.join(search.SEARCH_INDEX_PATH, search.SEARCH_INDEX_FILE)
+    try:
+        if not os.path.exists(index_file):
+            os.makedirs(search.SEARCH_INDEX_PATH, exist_ok = True)
+            storage_client = storage.Client(project = PROJECT_ID)
+            bucket = storage_client.bucket(GCP_BUCKET_NAME)
+            bucket.blob(f"search_index/{search.SEARCH_INDEX_FILE}").download_to_filename(index_file)
+
+        return load_search_index(os.path.getmtime(index_file))
+    except Exception as e:
+        print(f"Error loading search index: {e}")
+
+        return None
+
+@st.cache_data(ttl = 600)
+def fetch_atlas_map(version):
+    """Offsets of every thumbnail in the sprite atlases, read from disk or GCS.
+
+    Cached per map version when the map is on disk, so a new map is picked up at once.
+    """
+
+    map_file = os.path.join(sprites.ATLAS_PATH, sprites.ATLAS_MAP_FILE)
+    try:
+        if os.path.exists(map_file):
+            return sprites.read_atlas_map(sprites.ATLAS_PATH)
+
+        storage_client = storage.Client(project = PROJECT_ID)
+        bucket = storage_client.bucket(GCP_BUCKET_NAME)
+
+        return json.loads(bucket.blob(f"atlases/{sprites.ATLAS_MAP_FILE}").download_as_text())
+    except Exception as e:
+        print(f"Error loading atlas map: {e}")
+
+        return {"partitions": {}, "atlases": {}, "tiles": {}}
+
+def render_thumbnail(row, atlas_map):
+    """A tile cut from a shared atlas, so the page makes one request per atlas instead of one per thumbnail."""
+
+    atlas_url = f"https://storage.googleapis.com/{GCP_BUCKET_NAME}/atlases/"
+    style = sprites.tile_style(atlas_map, atlas_url, row['images'])
+    if style is None:
+        return f"""<img src="{row['thumbnails_public_url']}" alt="{row['prompt_concept']}">"""
+
+    return f"""<div class="sprite-tile" role="img" aria-label="{row['prompt_concept']}" style="{style}"></div>"""
+
+def search_gallery(df, query):
+    """Keep the rows whose prompt matches the query, ordered by BM25 rank."""
+
+    index = get_search_index()
+    if index is None:
+        st.warning("Search is unavailable. Please run the upload pipeline to build the search index.")
+
+        return df
+
+    results = search.search(index, query, top_k = SEARCH_RESULTS)
+    ranks = {doc_id: rank for rank, (doc_id, _) in enumerate(results)}
+    df = df[df['id'].isin(ranks)].copy()
+    df['rank'] = df['id'].map(ranks)
+
+    return df.sort_values('rank').reset_index(drop = True)
+
 def parse_args():
     """Get the argument to show 1 image only for each concept"""
 
@@ -123,15 +196,24 @@ def main():
         st.rerun()
 
     st.header("The Gallery")
+    query = st.text_input("Search prompts", placeholder = "Search by prompt or creative reasoning")
+    gallery_df = st.session_state.shuffled_list
+    if query.strip():
+        gallery_df = search_gallery(gallery_df, query)
+        if gallery_df.empty:
+            st.info(f"No images match \"{query}\".")
+
+    map_file = os.path.join(sprites.ATLAS_PATH, sprites.ATLAS_MAP_FILE)
+    atlas_map = fetch_atlas_map(os.path.getmtime(map_file) if os.path.exists(map_file) else None)
     cols = st.columns(4)
 
-    for i, row in st.session_state.shuffled_list.iterrows():
+    for i, row in gallery_df.iterrows():
         col = cols[i % len(cols)]
         with col: 
             st.markdown(
                 f"""
                     <a href="/details?images={row['images']}" target="_self">
-                        <img src="{row['thumbnails_public_url']}" alt="{row['prompt_concept']}">
+                        {render_thumbnail(row, atlas_map)}
                     </a>
                     """, unsafe_allow_html = True
                 )
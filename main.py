@@ -1,8 +1,13 @@
 import generate
 import save_display
 import upload
+import pipeline
+import recompress
 import gallery
 
+import os
+import argparse
+import functools
 import subprocess
 import sys
 import warnings
@@ -23,11 +28,117 @@ NUMBER_OF_IMAGES = 2
 ASPECT_RATIO = "3:4" # "1:1", "3:4", "4:3", "9:16", and "16:9". Default "1:1"
 UNIQUE_CONCEPT = 0 # same concept may have more than 1 image; 0 to show all images, 1 to show 1 image per concept
 
-def main():
+NUMBER_OF_CONCEPTS = 1 # each concept is a separate, paid text and Imagen generation pass
+SHOW_PREVIEW = True # show each concept's images side by side once the pipeline has finished
+# workers per pipeline stage; generation is bound by the Gemini API, upload by the network
+GENERATE_WORKERS = 2
+SAVE_WORKERS = 1
+THUMBNAIL_WORKERS = 2
+UPLOAD_WORKERS = 4
+QUEUE_SIZE = 4
+RECOMPRESS_IMAGES = False # optional: losslessly re-encode masters before thumbnailing and upload
+RECOMPRESS_WORKERS = os.cpu_count() or 1
+
+def generate_concept(_):
 
     prompt_concept, initial_image_prompt, images = generate.run_generate_pipeline(GEMINI_TEXT_MODEL, GEMINI_IMAGE_MODEL, TEMPERATURE, NUMBER_OF_IMAGES, ASPECT_RATIO)
-    save_display.run_save_and_display_pipeline(prompt_concept, initial_image_prompt, images)
-    upload.run_upload_pipeline(IMAGE_PATH, PROMPT_PATH, OUTPUT_NDJSON_PATH, OUTPUT_NDJSON_FILE, THUMBNAIL_PATH)
+    if not images:
+        return
+
+    return prompt_concept, initial_image_prompt, images
+
+def save_concept(generated):
+
+    filenames = save_display.name_and_save_files(*generated)
+
+    return [os.path.join(IMAGE_PATH, filename) for filename in filenames]
+
+def recompress_image(executor, records, image_file):
+    """Recompression is optional, so a failure passes the original image on instead of dropping it."""
+
+    try:
+        record = executor.submit(recompress.recompress_image, image_file).result()
+    except Exception as e:
+        print(f"Error recompressing {image_file}, keeping the original: {e}")
+
+        return image_file
+
+    # the image has not been uploaded yet, so there is no old file name to clean up
+    record["cleanup_pending"] = False
+    records.append(record)
+
+    return record["file"]
+
+def thumbnail_image(image_file):
+
+    upload.create_thumbnail(image_file, THUMBNAIL_PATH)
+
+    return image_file
+
+def upload_image(image_file):
+
+    upload.upload_file_to_gcp_bucket(image_file, "images")
+    upload.upload_file_to_gcp_bucket(upload.create_thumbnail_path(image_file, THUMBNAIL_PATH), "thumbnails")
+
+    return image_file
+
+def show_previews(image_files):
+
+    concepts = {}
+    for image_file in sorted(image_files):
+        filename = os.path.basename(image_file)
+        concepts.setdefault("_".join(filename.split("_")[:2]), []).append(filename)
+
+    for filenames in concepts.values():
+        save_display.display_images_side_by_side(filenames)
+
+def run_staged_pipeline():
+    """Generate, save, thumbnail and upload concurrently, so image N is uploaded while image N + 1 is generated."""
+
+    records = []
+    stages = [
+        pipeline.make_stage("generate", generate_concept, GENERATE_WORKERS, QUEUE_SIZE),
+        pipeline.make_stage("save", save_concept, SAVE_WORKERS, QUEUE_SIZE, fan_out = True),
+    ]
+    executor = recompress.create_process_pool(RECOMPRESS_WORKERS) if RECOMPRESS_IMAGES else None
+    if executor is not None:
+        stages.append(pipeline.make_stage("recompress", functools.partial(recompress_image, executor, records), RECOMPRESS_WORKERS, QUEUE_SIZE))
+    stages += [
+        pipeline.make_stage("thumbnail", thumbnail_image, THUMBNAIL_WORKERS, QUEUE_SIZE),
+        pipeline.make_stage("upload", upload_image, UPLOAD_WORKERS, QUEUE_SIZE),
+    ]
+    try:
+        uploaded, _ = pipeline.run_staged_pipeline(range(NUMBER_OF_CONCEPTS), stages)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    print(f"--- Successfully generated and uploaded {len(uploaded)} images. ---")
+    if SHOW_PREVIEW:
+        show_previews(uploaded)
+
+    if records:
+        recompress.write_recompress_log(records)
+        recompress.print_recompress_summary(records)
+
+    # the catalog covers every image, so it is rebuilt once at the end; the index and atlas
+    # paths are left to their module defaults, which the Streamlit pages also read
+    upload.run_catalog_pipeline(IMAGE_PATH, PROMPT_PATH, OUTPUT_NDJSON_PATH, OUTPUT_NDJSON_FILE, THUMBNAIL_PATH)
+
+def parse_args():
+    """--backfill re-processes the images already on disk instead of generating new ones"""
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backfill", action = "store_true")
+    args, _ = parser.parse_known_args()
+
+    return args
+
+def main():
+
+    if parse_args().backfill:
+        upload.run_upload_pipeline(IMAGE_PATH, PROMPT_PATH, OUTPUT_NDJSON_PATH, OUTPUT_NDJSON_FILE, THUMBNAIL_PATH, recompress_images = RECOMPRESS_IMAGES)
+    else:
+        run_staged_pipeline()
 
     # Streamlit app
     command = [sys.executable, "-m", "streamlit", "run", "gallery.py", "--", f"--unique_concept={UNIQUE_CONCEPT}"]
@@ -1,8 +1,9 @@
 import gallery
+import similar
 
 import streamlit as st
 import pandas as pd
-from google.cloud import bigquery
+from google.cloud import storage, bigquery
 from dotenv import load_dotenv
 import os
 
@@ -11,6 +12,7 @@ PROJECT_ID = os.environ["PROJECT_ID"]
 GCP_BUCKET_NAME = os.environ["GCP_BUCKET_NAME"]
 BIGQUERY_DATASET_ID = os.environ["BIGQUERY_DATASET_ID"]
 BIGQUERY_TABLE_ID2 = os.environ["BIGQUERY_TABLE_ID2"]
+SIMILAR_IMAGES = 4
 
 @st.cache_data(ttl = 3600)
 def fetch_single_image_data(images):
@@ -37,6 +39,53 @@ def fetch_single_image_data(images):
 
         return None
 
+@st.cache_resource
+def load_similar_index(version):
+    """Cached per index version, so images added by a later upload run are picked up."""
+
+    return similar.load_similar_index(similar.SIMILAR_INDEX_PATH)
+
+def get_similar_index():
+
+    keys_file = os.path.join(similar.SIMILAR_INDEX_PATH, similar.KEYS_FILE)
+    try:
+        if not os.path.exists(keys_file):
+            os.makedirs(similar.SIMILAR_INDEX_PATH, exist_ok = True)
+            storage_client = storage.Client(project = PROJECT_ID)
+            bucket = storage_client.bucket(GCP_BUCKET_NAME)
+            for file in [similar.VECTORS_FILE, similar.KEYS_FILE]:
+                bucket.blob(f"similar_index/{file}").download_to_filename(os.path.join(similar.SIMILAR_INDEX_PATH, file))
+
+        return load_similar_index(os.path.getmtime(keys_file))
+    except Exception as e:
+        print(f"Error loading similar image index: {e}")
+
+        return None
+
+def show_similar_images(images):
+
+    index = get_similar_index()
+    if index is None:
+        return
+
+    similar_images = similar.find_similar(index, images, top_k = SIMILAR_IMAGES)
+    if not similar_images:
+        return
+
+    st.divider()
+    st.subheader("Similar Images")
+    url = f"https://storage.googleapis.com/{GCP_BUCKET_NAME}/thumbnails/"
+    cols = st.columns(SIMILAR_IMAGES)
+    for col, image in zip(cols, similar_images):
+        with col:
+            st.markdown(
+                f"""
+                    <a href="/details?images={image}" target="_self">
+                        <img src="{url}{similar.thumbnail_name(image)}" alt="{image}">
+                    </a>
+                    """, unsafe_allow_html = True
+                )
+
 def main():
 
     st.set_page_config(page_title = "Image Details", page_icon = "🎨", layout = "wide")
@@ -78,5 +127,7 @@ def main():
             key = "final_prompt_textarea" # Give it a key for CSS targeting
         )
 
+    show_similar_images(selected_image)
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
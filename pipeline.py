@@ -0,0 +1,142 @@
+import queue
+import threading
+import time
+
+_SENTINEL = object()
+
+def make_stage(name, func, workers = 1, queue_size = 4, fan_out = False):
+    """Describe one pipeline stage.
+
+    func takes one item and returns the item for the next stage, or None to drop it.
+    With fan_out, func returns a list and each element is passed on separately.
+    queue_size bounds the queue in front of the stage, so a slow stage blocks the
+    stages upstream of it instead of letting work pile up in memory.
+    """
+
+    return {
+        "name": name,
+        "func": func,
+        "workers": workers,
+        "queue_size": queue_size,
+        "fan_out": fan_out,
+    }
+
+def new_stats(stage):
+
+    return {
+        "name": stage["name"],
+        "workers": stage["workers"],
+        "items": 0,
+        "errors": 0,
+        "busy": 0.0,     # seconds spent running func
+        "waiting": 0.0,  # seconds spent waiting for input
+        "blocked": 0.0,  # seconds spent waiting for room downstream
+        "lock": threading.Lock(),
+    }
+
+def put_timed(q, item, stats, key):
+
+    start = time.perf_counter()
+    q.put(item)
+    with stats["lock"]:
+        stats[key] += time.perf_counter() - start
+
+def stage_worker(stage, stats, in_queue, out_queue):
+
+    while True:
+        start = time.perf_counter()
+        item = in_queue.get()
+        waited = time.perf_counter() - start
+        with stats["lock"]:
+            stats["waiting"] += waited
+        if item is _SENTINEL:
+            return
+
+        start = time.perf_counter()
+        try:
+            result = stage["func"](item)
+        except Exception as e:
+            print(f"Error in {stage['name']} stage: {e}")
+            result = None
+            with stats["lock"]:
+                stats["errors"] += 1
+        busy = time.perf_counter() - start
+        with stats["lock"]:
+            stats["busy"] += busy
+            stats["items"] += 1
+
+        if result is None:
+            continue
+        outputs = result if stage["fan_out"] else [result]
+        for output in outputs:
+            put_timed(out_queue, output, stats, "blocked")
+
+def close_stage(threads, out_queue, downstream_workers):
+    """Once every worker of a stage has finished, tell the next stage there is no more input."""
+
+    for thread in threads:
+        thread.join()
+    for _ in range(downstream_workers):
+        out_queue.put(_SENTINEL)
+
+def print_stage_stats(all_stats, wall_time):
+
+    print(f"--- Pipeline finished in {wall_time:.1f}s. ---")
+    print(f"{'stage':<12}{'workers':>8}{'items':>7}{'errors':>7}{'busy s':>9}{'util':>7}{'wait s':>9}{'blocked s':>11}")
+    for stats in all_stats:
+        utilisation = stats["busy"] / (stats["workers"] * wall_time) if wall_time > 0 else 0.0
+        print(
+            f"{stats['name']:<12}{stats['workers']:>8}{stats['items']:>7}{stats['errors']:>7}"
+            f"{stats['busy']:>9.1f}{utilisation:>7.0%}{stats['waiting']:>9.1f}{stats['blocked']:>11.1f}"
+        )
+
+def run_staged_pipeline(items, stages):
+    """Run items through the stages concurrently, with bounded queues between them.
+
+    Returns the outputs of the last stage and the per-stage stats. A stage with high
+    utilisation and little waiting is the bottleneck; stages upstream of it will show
+    time blocked on a full queue.
+    """
+
+    queues = [queue.Queue(maxsize = stage["queue_size"]) for stage in stages]
+    queues.append(queue.Queue()) # collects the outputs of the last stage
+    all_stats = [new_stats(stage) for stage in stages]
+    start = time.perf_counter()
+
+    closers = []
+    for i, stage in enumerate(stages):
+        threads = [
+            threading.Thread(
+                target = stage_worker, args = (stage, all_stats[i], queues[i], queues[i + 1]),
+                name = f"{stage['name']}-{n}", daemon = True
+            )
+            for n in range(stage["workers"])
+        ]
+        for thread in threads:
+            thread.start()
+
+        downstream_workers = stages[i + 1]["workers"] if i + 1 < len(stages) else 1
+        closer = threading.Thread(target = close_stage, args = (threads, queues[i + 1], downstream_workers), daemon = True)
+        closer.start()
+        closers.append(closer)
+
+    for item in items:
+        queues[0].put(item)
+    for _ in range(stages[0]["workers"]):
+        queues[0].put(_SENTINEL)
+
+    for closer in closers:
+        closer.join()
+    wall_time = time.perf_counter() - start
+
+    results = []
+    while True:
+        output = queues[-1].get()
+        if output is _SENTINEL:
+            break
+        results.append(output)
+
+    print_stage_stats(all_stats, wall_time)
+    all_stats = [{k: v for k, v in stats.items() if k != "lock"} for stats in all_stats]
+
+    return results, all_stats
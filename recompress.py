@@ -0,0 +1,191 @@
+import os
+import io
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, PngImagePlugin
+
+RECOMPRESS_LOG_FILE = "./recompress_log.json"
+ALLOW_WEBP = True
+
+def encode_png(img):
+
+    pnginfo = PngImagePlugin.PngInfo()
+    for k, v in getattr(img, "text", {}).items():
+        pnginfo.add_text(k, v)
+
+    buffer = io.BytesIO()
+    img.save(
+        buffer, "PNG", optimize = True, pnginfo = pnginfo,
+        icc_profile = img.info.get("icc_profile"), exif = img.info.get("exif", b"")
+    )
+
+    return buffer.getvalue()
+
+def encode_webp(img):
+
+    buffer = io.BytesIO()
+    img.save(
+        buffer, "WEBP", lossless = True, quality = 100, method = 6, exact = True,
+        icc_profile = img.info.get("icc_profile"), exif = img.info.get("exif", b"")
+    )
+
+    return buffer.getvalue()
+
+def is_lossless(img, encoded):
+    """Same pixels and the same colour profile, so the image looks identical."""
+
+    with Image.open(io.BytesIO(encoded)) as decoded:
+        if decoded.size != img.size:
+            return False
+        if decoded.info.get("icc_profile") != img.info.get("icc_profile"):
+            return False
+        if img.info.get("exif") and decoded.info.get("exif") != img.info.get("exif"):
+            return False
+
+        return decoded.convert("RGBA").tobytes() == img.convert("RGBA").tobytes()
+
+def recompress_image(file, allow_webp = ALLOW_WEBP):
+    """Re-encode one image losslessly and keep the smallest identical-looking file.
+
+    A WebP result replaces the PNG under the same name with a .webp extension.
+    Masters with PNG text chunks stay PNG, as WebP cannot keep them. On any error
+    the original file is kept. Returns a record with the final file and the bytes saved.
+    """
+
+    original_bytes = os.path.getsize(file)
+    record = {
+        "file": file,
+        "original_file": file,
+        "format": "original",
+        "original_bytes": original_bytes,
+        "final_bytes": original_bytes,
+        "bytes_saved": 0,
+        "cleanup_pending": False, # the old file name may still be in GCS and the local indexes
+    }
+
+    try:
+        with Image.open(file) as img:
+            img.load()
+            candidates = [("png", encode_png(img))]
+            if allow_webp and img.mode in ("RGB", "RGBA") and not getattr(img, "text", {}):
+                candidates.append(("webp", encode_webp(img)))
+            candidates = [(fmt, data) for fmt, data in candidates if is_lossless(img, data)]
+
+        if not candidates:
+            return record
+
+        fmt, data = min(candidates, key = lambda candidate: len(candidate[1]))
+        if len(data) >= original_bytes:
+            return record
+
+        output_file = f"{os.path.splitext(file)[0]}.{fmt}"
+        temp_file = f"{output_file}.tmp"
+        with open(temp_file, "wb") as f:
+            f.write(data)
+        os.replace(temp_file, output_file)
+        if output_file != file:
+            os.remove(file)
+    except Exception as e:
+        print(f"Error recompressing {file}, keeping the original: {e}")
+
+        return record
+
+    record.update({
+        "file": output_file,
+        "format": fmt,
+        "final_bytes": len(data),
+        "bytes_saved": original_bytes - len(data),
+        "cleanup_pending": output_file != file,
+    })
+
+    return record
+
+def read_recompressed_files(log_file = RECOMPRESS_LOG_FILE):
+
+    if not os.path.exists(log_file):
+        return set()
+
+    with open(log_file, "r") as f:
+        return {os.path.basename(json.loads(line)["file"]) for line in f if line.strip()}
+
+def read_recompress_log(log_file = RECOMPRESS_LOG_FILE):
+
+    if not os.path.exists(log_file):
+        return []
+
+    with open(log_file, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def pending_cleanups(log_file = RECOMPRESS_LOG_FILE):
+    """Masters that changed extension but whose old file name has not been cleaned up yet."""
+
+    return [record for record in read_recompress_log(log_file) if record.get("cleanup_pending")]
+
+def mark_cleaned_up(original_files, log_file = RECOMPRESS_LOG_FILE):
+
+    original_files = set(original_files)
+    if not original_files:
+        return
+
+    records = read_recompress_log(log_file)
+    for record in records:
+        if record.get("original_file") in original_files:
+            record["cleanup_pending"] = False
+
+    try:
+        with open(log_file, "w") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+    except Exception as e:
+        print(f"Error writing recompression log: {e}")
+
+def write_recompress_log(records, log_file = RECOMPRESS_LOG_FILE):
+
+    try:
+        with open(log_file, "a") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+    except Exception as e:
+        print(f"Error writing recompression log: {e}")
+
+def print_recompress_summary(records):
+
+    original_bytes = sum(record["original_bytes"] for record in records)
+    bytes_saved = sum(record["bytes_saved"] for record in records)
+    ratio = bytes_saved / original_bytes if original_bytes else 0.0
+    print(f"--- Recompressed {len(records)} images, saved {bytes_saved / 1e6:.1f} MB ({ratio:.0%}). ---")
+
+def create_process_pool(workers = None):
+    """Spawned workers, since forking a process whose threads are mid HTTP call can deadlock the child."""
+
+    return ProcessPoolExecutor(max_workers = workers, mp_context = multiprocessing.get_context("spawn"))
+
+def recompress_images(files, workers = None, allow_webp = ALLOW_WEBP):
+
+    records = []
+    with create_process_pool(workers) as executor:
+        futures = {file: executor.submit(recompress_image, file, allow_webp) for file in files}
+        for file, future in futures.items():
+            try:
+                records.append(future.result())
+            except Exception as e:
+                print(f"Error recompressing {file}: {e}")
+
+    return records
+
+def run_recompress_pipeline(files, log_file = RECOMPRESS_LOG_FILE, workers = None):
+    """Recompress the images that have not been recompressed before and log the bytes saved."""
+
+    done = read_recompressed_files(log_file)
+    files = [file for file in files if os.path.basename(file) not in done]
+    if not files:
+        print("No new images to recompress.")
+
+        return []
+
+    records = recompress_images(files, workers)
+    write_recompress_log(records, log_file)
+    print_recompress_summary(records)
+
+    return records
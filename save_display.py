@@ -101,8 +101,3 @@ def display_images_side_by_side(filenames):
         print(f"Error: One of the files was not found. {e}")
     except Exception as e:
         print(f"An error occurred: {e}")
-
-def run_save_and_display_pipeline(prompt_concept, initial_image_prompt, images):
-    
-    filenames = name_and_save_files(prompt_concept, initial_image_prompt, images)
-    display_images_side_by_side(filenames)
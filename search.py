@@ -0,0 +1,150 @@
+import os
+import re
+import glob
+import json
+import numpy as np
+
+SEARCH_INDEX_PATH = "./search_index/"
+SEARCH_INDEX_FILE = "search_index.npz"
+SEARCH_FIELDS = ["prompt_concept", "creative_concept", "final_prompt"]
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+def tokenize(text):
+
+    if not text:
+        return []
+
+    return TOKEN_PATTERN.findall(str(text).lower())
+
+def read_prompt_documents(prompt_path):
+    """Read the prompt JSONs as (id, text) pairs, one document per prompt."""
+
+    documents = []
+    for file in sorted(glob.glob(os.path.join(prompt_path, "*.json"))):
+        try:
+            with open(file, "r") as f:
+                data = json.load(f)
+        except Exception as e:
+            print(f"Error loading JSON {file}: {e}")
+            continue
+
+        for k, v in data.items():
+            if isinstance(v, dict):
+                text = " ".join(str(v.get(field, "")) for field in SEARCH_FIELDS)
+                documents.append((k, text))
+
+    return documents
+
+def build_search_index(documents):
+    """Build an inverted index with array-backed postings.
+
+    The postings of term i are doc_indices[offsets[i]:offsets[i + 1]] with the
+    matching term_freqs, so the whole index is a handful of flat arrays.
+    """
+
+    doc_ids = []
+    doc_lengths = []
+    postings = {}
+    for doc_index, (doc_id, text) in enumerate(documents):
+        tokens = tokenize(text)
+        doc_ids.append(doc_id)
+        doc_lengths.append(len(tokens))
+
+        counts = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        for token, count in counts.items():
+            postings.setdefault(token, []).append((doc_index, count))
+
+    vocabulary = sorted(postings)
+    offsets = np.zeros(len(vocabulary) + 1, dtype = np.int64)
+    for i, term in enumerate(vocabulary):
+        offsets[i + 1] = offsets[i] + len(postings[term])
+
+    doc_indices = np.empty(offsets[-1], dtype = np.int32)
+    term_freqs = np.empty(offsets[-1], dtype = np.int32)
+    for i, term in enumerate(vocabulary):
+        term_postings = np.asarray(postings[term], dtype = np.int32).reshape(-1, 2)
+        doc_indices[offsets[i]:offsets[i + 1]] = term_postings[:, 0]
+        term_freqs[offsets[i]:offsets[i + 1]] = term_postings[:, 1]
+
+    return {
+        "vocabulary": np.asarray(vocabulary, dtype = str),
+        "offsets": offsets,
+        "doc_indices": doc_indices,
+        "term_freqs": term_freqs,
+        "doc_ids": np.asarray(doc_ids, dtype = str),
+        "doc_lengths": np.asarray(doc_lengths, dtype = np.int32),
+    }
+
+def save_search_index(index, index_path = SEARCH_INDEX_PATH, index_file = SEARCH_INDEX_FILE):
+
+    try:
+        os.makedirs(index_path, exist_ok = True)
+        output_file = os.path.join(index_path, index_file)
+        np.savez_compressed(output_file, **index)
+        print(f"--- Successfully wrote search index of {len(index['doc_ids'])} prompts to {output_file}. ---")
+
+        return output_file
+    except Exception as e:
+        print(f"Error saving search index: {e}")
+
+        return
+
+def load_search_index(index_file):
+
+    with np.load(index_file) as data:
+        index = {k: data[k] for k in data.files}
+    index["term_lookup"] = {term: i for i, term in enumerate(index["vocabulary"].tolist())}
+    lengths = index["doc_lengths"]
+    index["avg_doc_length"] = float(lengths.mean()) if len(lengths) else 0.0
+
+    return index
+
+def search(index, query, top_k = 50):
+    """Rank documents against the query with BM25; returns [(id, score), ...]."""
+
+    n_docs = len(index["doc_ids"])
+    terms = set(tokenize(query))
+    if not n_docs or not terms:
+        return []
+
+    offsets = index["offsets"]
+    doc_lengths = index["doc_lengths"]
+    length_norm = K1 * (1 - B + B * doc_lengths / max(index["avg_doc_length"], 1e-9))
+    scores = np.zeros(n_docs, dtype = np.float32)
+
+    for term in terms:
+        term_index = index["term_lookup"].get(term)
+        if term_index is None:
+            continue
+
+        start, end = offsets[term_index], offsets[term_index + 1]
+        docs = index["doc_indices"][start:end]
+        tf = index["term_freqs"][start:end]
+        idf = np.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+        scores[docs] += idf * tf * (K1 + 1) / (tf + length_norm[docs])
+
+    matched = np.flatnonzero(scores)
+    if len(matched) > top_k:
+        matched = matched[np.argpartition(-scores[matched], top_k)[:top_k]]
+    matched = matched[np.argsort(-scores[matched])]
+
+    return [(str(index["doc_ids"][i]), float(scores[i])) for i in matched]
+
+def run_search_index_pipeline(prompt_path, index_path = SEARCH_INDEX_PATH, index_file = SEARCH_INDEX_FILE):
+
+    documents = read_prompt_documents(prompt_path)
+    if not documents:
+        print(f"No prompts found in {prompt_path}; search index not built.")
+
+        return
+
+    index = build_search_index(documents)
+
+    return save_search_index(index, index_path, index_file)
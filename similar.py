@@ -0,0 +1,172 @@
+import os
+import glob
+import json
+import zlib
+import numpy as np
+from PIL import Image
+import search
+
+SIMILAR_INDEX_PATH = "./similar_index/"
+VECTORS_FILE = "vectors.f32"
+KEYS_FILE = "keys.json"
+
+COLOUR_BINS = 4 # per channel, so the joint RGB histogram has 4 ** 3 bins
+PIXEL_SIZE = (8, 8)
+TEXT_DIM = 256
+FEATURE_DIM = COLOUR_BINS ** 3 + PIXEL_SIZE[0] * PIXEL_SIZE[1] * 3 + TEXT_DIM
+
+# relative weight of each feature block in the cosine similarity
+COLOUR_WEIGHT = 1.0
+PIXEL_WEIGHT = 0.5
+TEXT_WEIGHT = 1.0
+
+def thumbnail_name(image):
+
+    base, ext = os.path.splitext(image)
+
+    return f"{base}_thumbnail{ext}"
+
+def image_id(image):
+    """Images share the id of their prompt JSON as the first two parts of the file name."""
+
+    return "_".join(image.split("_")[:2])
+
+def normalize(vector):
+
+    norm = np.linalg.norm(vector)
+
+    return vector / norm if norm > 0 else vector
+
+def colour_histogram(pixels):
+
+    bins = (pixels // (256 // COLOUR_BINS)).astype(np.int64)
+    joint = (bins[..., 0] * COLOUR_BINS + bins[..., 1]) * COLOUR_BINS + bins[..., 2]
+    histogram = np.bincount(joint.ravel(), minlength = COLOUR_BINS ** 3).astype(np.float32)
+
+    return normalize(np.sqrt(histogram))
+
+def pixel_vector(img):
+
+    small = np.asarray(img.resize(PIXEL_SIZE, Image.BILINEAR), dtype = np.float32).ravel() / 255
+
+    return normalize(small - small.mean())
+
+def text_vector(text):
+    """Hash prompt tokens into a fixed number of buckets; crc32 keeps buckets stable across runs."""
+
+    vector = np.zeros(TEXT_DIM, dtype = np.float32)
+    for token in search.tokenize(text):
+        vector[zlib.crc32(token.encode()) % TEXT_DIM] += 1
+
+    return normalize(np.log1p(vector))
+
+def compute_features(thumbnail_file, text):
+
+    with Image.open(thumbnail_file) as img:
+        img = img.convert("RGB")
+        pixels = np.asarray(img)
+        features = np.concatenate([
+            np.sqrt(COLOUR_WEIGHT) * colour_histogram(pixels),
+            np.sqrt(PIXEL_WEIGHT) * pixel_vector(img),
+            np.sqrt(TEXT_WEIGHT) * text_vector(text),
+        ])
+
+    return normalize(features).astype(np.float32)
+
+def read_keys(index_path):
+
+    keys_file = os.path.join(index_path, KEYS_FILE)
+    if not os.path.exists(keys_file):
+        return []
+
+    with open(keys_file, "r") as f:
+        return json.load(f)
+
+def update_similar_index(thumbnail_path, data_list, index_path = SIMILAR_INDEX_PATH):
+    """Append feature vectors for thumbnails that are not in the index yet."""
+
+    try:
+        os.makedirs(index_path, exist_ok = True)
+        vectors_file = os.path.join(index_path, VECTORS_FILE)
+        keys = read_keys(index_path)
+
+        # an interrupted run can leave the two files out of step; start over if so
+        expected_bytes = len(keys) * FEATURE_DIM * np.dtype(np.float32).itemsize
+        if not os.path.exists(vectors_file) or os.path.getsize(vectors_file) != expected_bytes:
+            keys = []
+            open(vectors_file, "wb").close()
+
+        prompts = {item["id"]: item.get("final_prompt", "") for item in data_list or [] if item}
+        known = set(keys)
+        new_keys = []
+        new_vectors = []
+        for file in sorted(glob.glob(os.path.join(thumbnail_path, "*_thumbnail.*"))):
+            image = os.path.basename(file).replace("_thumbnail", "")
+            if image in known:
+                continue
+
+            new_vectors.append(compute_features(file, prompts.get(image_id(image), "")))
+            new_keys.append(image)
+
+        if not new_keys:
+            print("--- Similar image index is up to date. ---")
+
+            return
+
+        with open(vectors_file, "ab") as f:
+            f.write(np.stack(new_vectors).tobytes())
+        with open(os.path.join(index_path, KEYS_FILE), "w") as f:
+            json.dump(keys + new_keys, f)
+        print(f"--- Successfully added {len(new_keys)} images to the similar image index. ---")
+
+    except Exception as e:
+        print(f"Error updating similar image index: {e}")
+
+        return
+
+def rename_images(renames, index_path = SIMILAR_INDEX_PATH):
+    """Point existing vectors at the new file names of images whose extension changed."""
+
+    keys = read_keys(index_path)
+    if not any(key in renames for key in keys):
+        return
+
+    with open(os.path.join(index_path, KEYS_FILE), "w") as f:
+        json.dump([renames.get(key, key) for key in keys], f)
+    print(f"--- Renamed {len(renames)} images in the similar image index. ---")
+
+def load_similar_index(index_path = SIMILAR_INDEX_PATH):
+
+    keys = read_keys(index_path)
+    if keys:
+        vectors = np.memmap(
+            os.path.join(index_path, VECTORS_FILE), dtype = np.float32, mode = "r",
+            shape = (len(keys), FEATURE_DIM)
+        )
+    else:
+        vectors = np.zeros((0, FEATURE_DIM), dtype = np.float32)
+
+    return {
+        "keys": keys,
+        "positions": {key: i for i, key in enumerate(keys)},
+        "vectors": vectors,
+    }
+
+def find_similar(index, image, top_k = 4):
+    """Return the top_k nearest images by cosine similarity, excluding the image itself."""
+
+    position = index["positions"].get(image)
+    if position is None:
+        return []
+
+    vectors = index["vectors"]
+    scores = np.asarray(vectors @ vectors[position])
+    scores[position] = -np.inf
+    top_k = min(top_k, len(scores) - 1)
+    if top_k <= 0:
+        return []
+
+    nearest = np.argpartition(-scores, top_k - 1)[:top_k]
+    nearest = nearest[np.argsort(-scores[nearest])]
+
+    return [index["keys"][i] for i in nearest]
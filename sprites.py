@@ -0,0 +1,155 @@
+import os
+import glob
+import json
+import hashlib
+from PIL import Image
+
+ATLAS_PATH = "./atlases/"
+ATLAS_MAP_FILE = "atlas_map.json"
+CELL_SIZE = (256, 256) # thumbnails are at most 256 x 256
+ATLAS_COLUMNS = 16
+MAX_TILES_PER_ATLAS = 256 # keeps each atlas at 4096 x 4096, within the WebP size limit
+ATLAS_METHOD = 4 # WebP encoder effort; lossless so thumbnails that are already lossy WebP are not degraded again
+
+def partition_key(image):
+    """Atlases are partitioned by the creation date at the start of the file name."""
+
+    return image.split("_")[0]
+
+def read_atlas_map(atlas_path = ATLAS_PATH):
+
+    map_file = os.path.join(atlas_path, ATLAS_MAP_FILE)
+    if not os.path.exists(map_file):
+        return {"partitions": {}, "atlases": {}, "tiles": {}}
+
+    with open(map_file, "r") as f:
+        return json.load(f)
+
+def group_thumbnails(thumbnail_path):
+
+    partitions = {}
+    for file in sorted(glob.glob(os.path.join(thumbnail_path, "*_thumbnail.*"))):
+        image = os.path.basename(file).replace("_thumbnail", "")
+        partitions.setdefault(partition_key(image), []).append((image, file))
+
+    return partitions
+
+def partition_signature(thumbnails):
+    """File names and sizes, so a partition is rebuilt only when its thumbnails change."""
+
+    entries = [[image, os.path.getsize(file)] for image, file in thumbnails]
+
+    return hashlib.sha1(json.dumps(entries).encode()).hexdigest()
+
+def build_atlas(thumbnails, atlas_path, name):
+    """Pack thumbnails into a grid and return the atlas file name, its size and the tile offsets."""
+
+    columns = min(ATLAS_COLUMNS, len(thumbnails))
+    rows = -(-len(thumbnails) // columns)
+    atlas = Image.new("RGB", (columns * CELL_SIZE[0], rows * CELL_SIZE[1]))
+
+    tiles = {}
+    for i, (image, file) in enumerate(thumbnails):
+        x = (i % columns) * CELL_SIZE[0]
+        y = (i // columns) * CELL_SIZE[1]
+        with Image.open(file) as img:
+            img = img.convert("RGB")
+            atlas.paste(img, (x, y))
+            tiles[image] = {"x": x, "y": y, "w": img.width, "h": img.height}
+
+    content_hash = hashlib.sha1(atlas.tobytes()).hexdigest()[:8] # new name on change, so caches never serve a stale atlas
+    atlas_file = f"{name}_{content_hash}.webp"
+    atlas.save(os.path.join(atlas_path, atlas_file), "WEBP", lossless = True, method = ATLAS_METHOD)
+
+    return atlas_file, {"width": atlas.width, "height": atlas.height}, tiles
+
+def update_atlases(thumbnail_path, atlas_path = ATLAS_PATH):
+    """Rebuild the atlases of partitions whose thumbnails changed.
+
+    Nothing is committed here: returns the new map, the new atlas files and the names of
+    the atlases they replace. Save the map with save_atlas_map once the atlases are uploaded,
+    so a failed upload is retried on the next run.
+    """
+
+    try:
+        os.makedirs(atlas_path, exist_ok = True)
+        atlas_map = read_atlas_map(atlas_path)
+        new_files = []
+        replaced = []
+
+        for partition, thumbnails in group_thumbnails(thumbnail_path).items():
+            signature = partition_signature(thumbnails)
+            previous = atlas_map["partitions"].get(partition, {})
+            if previous.get("signature") == signature and all(
+                os.path.exists(os.path.join(atlas_path, atlas_file)) for atlas_file in previous.get("atlases", [])
+            ):
+                continue
+
+            for atlas_file in previous.get("atlases", []):
+                replaced.append(atlas_file)
+                atlas_map["atlases"].pop(atlas_file, None)
+            atlas_map["tiles"] = {
+                image: tile for image, tile in atlas_map["tiles"].items() if partition_key(image) != partition
+            }
+
+            atlas_files = []
+            for chunk, start in enumerate(range(0, len(thumbnails), MAX_TILES_PER_ATLAS)):
+                atlas_file, size, tiles = build_atlas(thumbnails[start:start + MAX_TILES_PER_ATLAS], atlas_path, f"{partition}_{chunk}")
+                atlas_map["atlases"][atlas_file] = size
+                for image, tile in tiles.items():
+                    atlas_map["tiles"][image] = {"atlas": atlas_file, **tile}
+                atlas_files.append(atlas_file)
+
+            atlas_map["partitions"][partition] = {"signature": signature, "atlases": atlas_files}
+            new_files += [os.path.join(atlas_path, atlas_file) for atlas_file in atlas_files]
+
+        print(f"--- Successfully rebuilt {len(new_files)} thumbnail atlases. ---")
+
+        return atlas_map, new_files, replaced
+
+    except Exception as e:
+        print(f"Error updating thumbnail atlases: {e}")
+
+        return None, [], []
+
+def retire_atlases(atlas_map, replaced, atlas_path = ATLAS_PATH):
+    """Keep replaced atlases for one more run, so pages still holding the previous map can load them.
+
+    Returns the atlases retired by the run before, which are now safe to delete.
+    """
+
+    live = set(atlas_map["atlases"])
+    expired = [atlas_file for atlas_file in read_atlas_map(atlas_path).get("retired", []) if atlas_file not in live]
+    atlas_map["retired"] = [atlas_file for atlas_file in replaced if atlas_file not in live]
+
+    return expired
+
+def save_atlas_map(atlas_map, atlas_path = ATLAS_PATH):
+    """Commit the map locally and drop local atlases it no longer uses."""
+
+    with open(os.path.join(atlas_path, ATLAS_MAP_FILE), "w") as f:
+        json.dump(atlas_map, f)
+
+    live = set(atlas_map["atlases"])
+    for file in glob.glob(os.path.join(atlas_path, "*.webp")):
+        if os.path.basename(file) not in live:
+            os.remove(file)
+
+def tile_style(atlas_map, atlas_url, image):
+    """CSS that shows one tile of an atlas and scales with the width of its container."""
+
+    tile = atlas_map["tiles"].get(image)
+    if tile is None:
+        return
+
+    atlas = atlas_map["atlases"][tile["atlas"]]
+    w, h = tile["w"], tile["h"]
+    size_x = atlas["width"] / w * 100
+    size_y = atlas["height"] / h * 100
+    position_x = tile["x"] / (atlas["width"] - w) * 100 if atlas["width"] > w else 0
+    position_y = tile["y"] / (atlas["height"] - h) * 100 if atlas["height"] > h else 0
+
+    return (
+        f"aspect-ratio: {w} / {h}; background-image: url('{atlas_url}{tile['atlas']}'); "
+        f"background-size: {size_x:.4f}% {size_y:.4f}%; background-position: {position_x:.4f}% {position_y:.4f}%;"
+    )
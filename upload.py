@@ -3,8 +3,13 @@ import glob
 from google.cloud import storage, bigquery
 from dotenv import load_dotenv
 import json
+import threading
 import pandas as pd
 from PIL import Image
+import search
+import similar
+import recompress
+import sprites
 
 load_dotenv()
 PROJECT_ID = os.environ["PROJECT_ID"]
@@ -12,29 +17,54 @@ GCP_BUCKET_NAME = os.environ["GCP_BUCKET_NAME"]
 BIGQUERY_DATASET_ID = os.environ["BIGQUERY_DATASET_ID"]
 BIGQUERY_TABLE_ID = os.environ["BIGQUERY_TABLE_ID"]
 BIGQUERY_TABLE_ID2 = os.environ["BIGQUERY_TABLE_ID2"]
+IMAGE_FORMATS = ["png", "webp"] # masters are webp when lossless webp is smaller than the png
 
-def upload_to_gcp_bucket(local_folder_path, file_format, gcp_destination_folder):
+_thread_local = threading.local()
 
-    try:
+def get_bucket():
+    """One storage client per thread, so pipeline upload workers do not share a session."""
+
+    if not hasattr(_thread_local, "bucket"):
         storage_client = storage.Client(project = PROJECT_ID)
-        bucket = storage_client.bucket(GCP_BUCKET_NAME)
+        _thread_local.bucket = storage_client.bucket(GCP_BUCKET_NAME)
+
+    return _thread_local.bucket
+
+def upload_file_to_gcp_bucket(file_path, gcp_destination_folder):
+
+    file_name = os.path.basename(file_path)
+    blob = get_bucket().blob(os.path.join(gcp_destination_folder, file_name))
+    blob.upload_from_filename(file_path)
+
+def delete_from_gcp_bucket(gcp_path):
 
+    try:
+        get_bucket().blob(gcp_path).delete()
+    except Exception as e:
+        print(f"An error occurred deleting {gcp_path} from GCS: {e}")
+
+def upload_to_gcp_bucket(local_folder_path, file_format, gcp_destination_folder):
+    """Returns the files that were uploaded, so callers can tell whether the upload completed."""
+
+    uploaded = []
+    try:
         file_paths = glob.glob(os.path.join(local_folder_path, f"*.{file_format}"))
         if not file_paths:
             print(f"No {file_format} files found in {local_folder_path}.")
 
-            return
+            return uploaded
         
         for file_path in file_paths:
-            file_name = os.path.basename(file_path)
-            blob = bucket.blob(os.path.join(gcp_destination_folder, file_name))
-            blob.upload_from_filename(file_path)
+            upload_file_to_gcp_bucket(file_path, gcp_destination_folder)
+            uploaded.append(file_path)
 
         print(f"--- Successfully uploaded {len(file_paths)} {file_format} files. ---")
+
+        return uploaded
     except Exception as e:
         print(f"An error occurred during GCS upload: {e}")
 
-        return
+        return uploaded
     
 def flatten_json(filepath):
 
@@ -130,21 +160,41 @@ def load_ndjson_from_gcs_to_bigquery(output_filepath, gcp_destination_folder = "
 
         return
 
+def list_images(image_path):
+
+    file_paths = []
+    for file_format in IMAGE_FORMATS:
+        file_paths += glob.glob(os.path.join(image_path, f"*.{file_format}"))
+
+    return sorted(file_paths)
+
+def create_thumbnail_path(file, thumbnail_path):
+
+    basenames = os.path.basename(file).split(".")
+    thumbnail_filename = f"{basenames[0]}_thumbnail.{basenames[1]}"
+
+    return os.path.join(thumbnail_path, thumbnail_filename)
+
+def create_thumbnail(file, thumbnail_path, size = (256, 256)):
+
+    thumbnail_file = create_thumbnail_path(file, thumbnail_path)
+    with Image.open(file) as img:
+        img.thumbnail(size)
+        img.save(thumbnail_file)
+
+    return thumbnail_file
+
 def create_thumbnails(image_path, thumbnail_path, size = (256, 256)):
 
     try:
-        file_paths = glob.glob(os.path.join(image_path, "*.png"))
+        file_paths = list_images(image_path)
         if not file_paths:
             print(f"No images found in {image_path}.")
 
             return
         
         for file in file_paths:
-            basenames = os.path.basename(file).split(".")
-            thumbnail_filename = f"{basenames[0]}_thumbnail.{basenames[1]}"
-            with Image.open(file) as img:
-                img.thumbnail(size)
-                img.save(os.path.join(thumbnail_path, thumbnail_filename))
+            create_thumbnail(file, thumbnail_path, size)
         print(f"--- Successfully created {len(file_paths)} thumbnails. ---")
 
     except Exception as e:
@@ -154,7 +204,7 @@ def create_thumbnails(image_path, thumbnail_path, size = (256, 256)):
 
 def create_public_urls(image_path, data_list):
 
-    image_paths = glob.glob(os.path.join(image_path, '*.png'))
+    image_paths = list_images(image_path)
     image_paths = [os.path.basename(path) for path in image_paths]
     df_images = pd.DataFrame(image_paths, columns = ["images"])
     df_images["id"] = df_images["images"].str.split("_").str[:2].str.join("_")
@@ -165,7 +215,7 @@ def create_public_urls(image_path, data_list):
     url = f"https://storage.googleapis.com/{GCP_BUCKET_NAME}/images/"
     df2["images_public_url"] = url + df2["images"]
 
-    df2["thumbnails"] = df2["images"].str.replace(".png", "_thumbnail.png")
+    df2["thumbnails"] = df2["images"].str.replace(r"\.(\w+)$", r"_thumbnail.\1", regex = True)
     url = f"https://storage.googleapis.com/{GCP_BUCKET_NAME}/thumbnails/"
     df2["thumbnails_public_url"] = url + df2["thumbnails"]
 
@@ -203,20 +253,118 @@ def load_df_to_bigquery(df):
 
         destination_table = client.get_table(table_ref)
         print(f"--- Job finished. Loaded {destination_table.num_rows} rows. ---")
+
+        return True
     except Exception as e:
         print(f"Error loading dataframe to BigQuery: {e}")
 
+        return False
+
+def upload_atlases(thumbnail_path, atlas_path = sprites.ATLAS_PATH):
+    """Only the atlases of changed partitions are uploaded, followed by the offset map that points at them.
+
+    The map is committed only after every new atlas is uploaded. Replaced atlases stay in GCS
+    for one more run and are deleted by the next one.
+    """
+
+    try:
+        atlas_map, atlas_files, replaced = sprites.update_atlases(thumbnail_path, atlas_path)
+        if atlas_map is None:
+            return
+
+        for atlas_file in atlas_files:
+            upload_file_to_gcp_bucket(atlas_file, "atlases")
+
+        expired = sprites.retire_atlases(atlas_map, replaced, atlas_path)
+        map_blob = get_bucket().blob(f"atlases/{sprites.ATLAS_MAP_FILE}")
+        map_blob.upload_from_string(json.dumps(atlas_map), content_type = "application/json")
+        sprites.save_atlas_map(atlas_map, atlas_path)
+
+        for atlas_file in expired:
+            delete_from_gcp_bucket(f"atlases/{atlas_file}")
+        print(f"--- Successfully uploaded {len(atlas_files)} atlases and removed {len(expired)} retired ones. ---")
+    except Exception as e:
+        print(f"An error occurred during atlas upload: {e}")
+
         return
 
-def run_upload_pipeline(image_path, prompt_path, output_ndjson_path, output_ndjson_file, thumbnail_path):
+def remove_replaced_local_files(records, thumbnail_path, similar_index_path = similar.SIMILAR_INDEX_PATH):
+    """Drop the old thumbnails so they are not indexed or packed next to the new ones."""
+
+    renames = {}
+    for record in records:
+        old_thumbnail = create_thumbnail_path(record["original_file"], thumbnail_path)
+        if os.path.exists(old_thumbnail):
+            os.remove(old_thumbnail)
+        renames[os.path.basename(record["original_file"])] = os.path.basename(record["file"])
+    similar.rename_images(renames, similar_index_path)
+
+def remove_replaced_blobs(records, uploaded, thumbnail_path):
+    """Delete the old masters and thumbnails of images whose new files are confirmed uploaded.
+
+    Call only after BigQuery has been reloaded, so no row still points at the old objects.
+    Returns the original files that were cleaned up.
+    """
+
+    uploaded = {os.path.normpath(file_path) for file_path in uploaded}
+    cleaned = []
+    for record in records:
+        new_thumbnail = create_thumbnail_path(record["file"], thumbnail_path)
+        if os.path.normpath(record["file"]) not in uploaded or os.path.normpath(new_thumbnail) not in uploaded:
+            print(f"Keeping the old GCS objects of {record['original_file']}: its new files were not uploaded.")
+            continue
+
+        image = os.path.basename(record["original_file"])
+        thumbnail = os.path.basename(create_thumbnail_path(image, thumbnail_path = ""))
+        delete_from_gcp_bucket(f"images/{image}")
+        delete_from_gcp_bucket(f"thumbnails/{thumbnail}")
+        cleaned.append(record["original_file"])
+
+    return cleaned
+
+def run_catalog_pipeline(image_path, prompt_path, output_ndjson_path, output_ndjson_file, thumbnail_path, search_index_path = search.SEARCH_INDEX_PATH, similar_index_path = similar.SIMILAR_INDEX_PATH, atlas_path = sprites.ATLAS_PATH):
+    """Rebuild the indexes and the BigQuery tables once the images and thumbnails are in place."""
 
     flattened_data_list = convert_to_ndjson(prompt_path, output_ndjson_path, output_ndjson_file)
-    create_thumbnails(image_path, thumbnail_path)
+    search.run_search_index_pipeline(prompt_path, search_index_path)
+    similar.update_similar_index(thumbnail_path, flattened_data_list, similar_index_path)
     df = create_public_urls(image_path, flattened_data_list)
 
     # upload to Google Cloud
-    upload_to_gcp_bucket(image_path, "png", "images")
     upload_to_gcp_bucket(prompt_path, "json", "prompts")
-    upload_to_gcp_bucket(thumbnail_path, "png", "thumbnails")
+    upload_to_gcp_bucket(search_index_path, "npz", "search_index")
+    upload_to_gcp_bucket(similar_index_path, "f32", "similar_index")
+    upload_to_gcp_bucket(similar_index_path, "json", "similar_index")
+    upload_atlases(thumbnail_path, atlas_path)
     load_ndjson_from_gcs_to_bigquery(output_ndjson_path, gcp_destination_folder = "ndjson_prompt", gcp_destination_file = output_ndjson_file)
-    load_df_to_bigquery(df)
\ No newline at end of file
+
+    return load_df_to_bigquery(df)
+
+def run_upload_pipeline(image_path, prompt_path, output_ndjson_path, output_ndjson_file, thumbnail_path, search_index_path = search.SEARCH_INDEX_PATH, similar_index_path = similar.SIMILAR_INDEX_PATH, recompress_images = False, atlas_path = sprites.ATLAS_PATH):
+    """Backfill: re-process and re-upload every image already on disk (`python main.py --backfill`).
+
+    With recompress_images, masters not recompressed before are re-encoded first. Masters that
+    changed extension have their old thumbnail removed locally, and their old GCS objects are
+    deleted only once the new files are uploaded and BigQuery has been reloaded; otherwise the
+    cleanup is retried on the next backfill.
+    """
+
+    if recompress_images:
+        recompress.run_recompress_pipeline(list_images(image_path))
+    pending = recompress.pending_cleanups()
+    remove_replaced_local_files(pending, thumbnail_path, similar_index_path)
+    create_thumbnails(image_path, thumbnail_path)
+
+    uploaded = []
+    for file_format in IMAGE_FORMATS:
+        uploaded += upload_to_gcp_bucket(image_path, file_format, "images")
+        uploaded += upload_to_gcp_bucket(thumbnail_path, file_format, "thumbnails")
+
+    if not run_catalog_pipeline(image_path, prompt_path, output_ndjson_path, output_ndjson_file, thumbnail_path, search_index_path, similar_index_path, atlas_path):
+        if pending:
+            print(f"BigQuery was not reloaded; keeping the old GCS objects of {len(pending)} recompressed images.")
+
+        return
+
+    cleaned = remove_replaced_blobs(pending, uploaded, thumbnail_path)
+    recompress.mark_cleaned_up(cleaned)